@@ -0,0 +1,93 @@
+"""Benchmark how make_sprite scales with the number of threads on one large image.
+
+Usage:
+    python benchmarks/sprite_threads.py --width 7680 --height 4320 --repeat 3
+
+Reports the time of the full make_sprite call and of the row-parallel alpha stage
+alone, since PNG decoding and encoding are single-threaded and dominate the former.
+"""
+
+import os
+import time
+from io import BytesIO
+
+import click
+import numpy as np
+from PIL import Image
+
+from tull.utils import make_sprite
+from tull.utils.colors import color_distance, get_color
+from tull.utils.parallel import map_rows
+
+
+def make_image(width: int, height: int) -> bytes:
+    """A white image with a dark blue disk and some noise, as an uncompressed TIFF."""
+    rng = np.random.default_rng(0)
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    y, x = np.ogrid[:height, :width]
+    disk = (x - width / 2) ** 2 + (y - height / 2) ** 2 < (min(width, height) / 3) ** 2
+    image[disk] = (0, 45, 114)
+    image = np.clip(image + rng.integers(-8, 8, image.shape), 0, 255).astype(np.uint8)
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, format="TIFF")
+    return buffer.getvalue()
+
+
+def best_of(repeat: int, func) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+@click.command()
+@click.option("--width", default=7680)
+@click.option("--height", default=4320)
+@click.option("--repeat", default=3)
+@click.option("--metric", default="rgb")
+def main(width, height, repeat, metric):
+    data = make_image(width, height)
+    rgb = np.asarray(Image.open(BytesIO(data)).convert("RGB"), dtype=np.float32) / 255
+    alpha = np.empty(rgb.shape[:2], dtype=np.float32)
+    bg_color = get_color("white")
+
+    def alpha_stage(threads):
+        def fuzz_alpha(strip, out):
+            out[:] = color_distance(strip, bg_color, metric)
+
+        map_rows(fuzz_alpha, rgb, alpha, threads=threads)
+
+    counts = [1]
+    while counts[-1] * 2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1] * 2)
+
+    print(f"{width}x{height}, metric={metric}, best of {repeat}")
+    print(
+        f"{'threads':>8} {'sprite (s)':>11} {'speedup':>8} {'alpha (s)':>10} {'speedup':>8}"
+    )
+    base_sprite = base_alpha = None
+    for threads in counts:
+        t_sprite = best_of(
+            repeat,
+            lambda: make_sprite(
+                BytesIO(data),
+                BytesIO(),
+                "white",
+                "gray",
+                metric=metric,
+                threads=threads,
+            ),
+        )
+        t_alpha = best_of(repeat, lambda: alpha_stage(threads))
+        base_sprite = base_sprite or t_sprite
+        base_alpha = base_alpha or t_alpha
+        print(
+            f"{threads:>8} {t_sprite:>11.3f} {base_sprite / t_sprite:>7.2f}x"
+            f" {t_alpha:>10.3f} {base_alpha / t_alpha:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
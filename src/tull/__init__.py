@@ -1 +1,8 @@
-from . import palettes
+import importlib
+
+
+def __getattr__(name: str):
+    # Import palettes (and with it NumPy) on first use, to keep the CLI quick to start.
+    if name == "palettes":
+        return importlib.import_module(f"{__name__}.palettes")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,18 +1,16 @@
 import click
 from pathlib import Path
-import numpy as np
 from rich.logging import RichHandler
-from PIL import Image
-import cv2
 import logging
-import matplotlib.pyplot as plt
-from stringcase import spinalcase, camelcase
 import shutil
-from rich.progress import track
 
-from .palettes import JHU, TUM, Palette
-from .utils import make_sprite
-from .utils import filenamecase
+from .client import send_request, is_running
+
+# The image processing modules import NumPy, OpenCV, etc., so they are imported in
+# the commands that need them. This keeps `tull sprite --server` fast to start.
+
+# Same as utils.colors.METRICS, which would import NumPy.
+METRICS = ("rgb", "lab", "deltaE2000")
 
 log = logging.getLogger("tull")
 
@@ -67,6 +65,20 @@ def cli(verbose, debug):
     default=True,
     help="Handle edges by setting alpha values to the difference between the pixel intensity and the background intensity.",
 )
+@click.option(
+    "--metric",
+    "-m",
+    type=click.Choice(METRICS),
+    default="rgb",
+    help='Color distance used to separate the foreground from the background. "rgb" is the mean absolute RGB difference, "lab" the Euclidean distance in CIE Lab, and "deltaE2000" the CIEDE2000 difference. The Lab metrics key dark or saturated foregrounds more accurately. Default is "rgb".',
+)
+@click.option(
+    "--threads",
+    "-t",
+    type=int,
+    default=1,
+    help="Number of threads to process a single image with. 0 uses all CPUs. Default is 1.",
+)
 @click.option(
     "--crop/--no-crop",
     default=True,
@@ -78,11 +90,52 @@ def cli(verbose, debug):
     type=int,
     help="Scale the transparency to this alpha value. If a float, it is a percentage of 255.",
 )
+@click.option(
+    "--server/--no-server",
+    default=False,
+    help="Send the work to a running `tull serve` process, if there is one. Otherwise, run locally.",
+)
+@click.option(
+    "--socket",
+    type=click.Path(),
+    default=None,
+    help="Socket of the server. Defaults to $TULL_SOCKET or a per-user path.",
+)
 def sprite(
-    input, output, background, foreground, edge, edge_thickness, fuzz, crop, alpha
+    input,
+    output,
+    background,
+    foreground,
+    edge,
+    edge_thickness,
+    fuzz,
+    metric,
+    threads,
+    crop,
+    alpha,
+    server,
+    socket,
 ):
     input_path = Path(input).absolute()
 
+    if server and not is_running(socket):
+        log.warning("No tull server is running. Processing locally.")
+        server = False
+
+    def run(input_path: Path, output_path: Path, **kwargs):
+        if server:
+            request = dict(
+                command="sprite",
+                input=str(input_path),
+                output=str(Path(output_path).absolute()),
+                **kwargs,
+            )
+            send_request(request, socket)
+        else:
+            from .utils import make_sprite
+
+            make_sprite(input_path, output_path, **kwargs)
+
     if input_path.is_dir():
         if output is None:
             output_path = input_path.parent / f"{input_path.stem}_sprites"
@@ -97,15 +150,17 @@ def sprite(
 
         for file in input_path.iterdir():
             if file.suffix in [".png", ".jpg", ".jpeg", ".gif"]:
-                make_sprite(
+                run(
                     file,
                     output_path / f"{file.stem}.png",
-                    background,
-                    foreground,
+                    background=background,
+                    foreground=foreground,
                     edge=edge,
                     edge_thickness=edge_thickness,
                     fuzz=fuzz,
                     crop=crop,
+                    metric=metric,
+                    threads=threads,
                 )
 
     else:
@@ -116,16 +171,18 @@ def sprite(
             else Path(output)
         )
 
-        make_sprite(
+        run(
             input_path,
             output_path,
-            background,
-            foreground,
+            background=background,
+            foreground=foreground,
             edge=edge,
             edge_thickness=edge_thickness,
             fuzz=fuzz,
             crop=crop,
             max_alpha=alpha,
+            metric=metric,
+            threads=threads,
         )
 
 
@@ -150,6 +207,20 @@ def sprite(
     default=True,
     help="Handle edges by setting alpha values to the difference between the pixel intensity and the background intensity.",
 )
+@click.option(
+    "--metric",
+    "-m",
+    type=click.Choice(METRICS),
+    default="rgb",
+    help='Color distance used to separate the foreground from the background. "rgb" is the mean absolute RGB difference, "lab" the Euclidean distance in CIE Lab, and "deltaE2000" the CIEDE2000 difference. The Lab metrics key dark or saturated foregrounds more accurately. Default is "rgb".',
+)
+@click.option(
+    "--threads",
+    "-t",
+    type=int,
+    default=1,
+    help="Number of threads to process a single image with. 0 uses all CPUs. Default is 1.",
+)
 @click.option(
     "--crop/--no-crop",
     default=True,
@@ -162,7 +233,17 @@ def sprite(
     default="TUM",
     help="Color palette to use. Currently only 'JHU' and 'TUM' are supported.",
 )
-def palette(input, output, background, fuzz, crop, palette: str):
+@click.option(
+    "--store",
+    "-s",
+    type=click.Path(file_okay=False),
+    default=None,
+    envvar="TULL_STORE",
+    help="Directory of a content-addressed store. Identical sprites are stored once and hardlinked into the output, and work that was already done is skipped. Defaults to $TULL_STORE, if set.",
+)
+def palette(
+    input, output, background, fuzz, metric, threads, crop, palette: str, store
+):
     input_path = Path(input)
     output_dir = (
         Path(output)
@@ -172,21 +253,58 @@ def palette(input, output, background, fuzz, crop, palette: str):
     if output_dir.exists():
         shutil.rmtree(output_dir)
     output_dir.mkdir(exist_ok=True, parents=True)
-    palette_name = palette.upper()
-    if palette_name not in ["TUM", "JHU"]:
-        raise ValueError(
-            f"Unsupported palette: {palette}. Supported palettes are TUM and JHU."
-        )
+    from rich.progress import track
+    from .utils import make_sprite, palette_sprite_paths
+    from .utils.store import AssetStore, write_manifest
 
-    palette: Palette = {"TUM": TUM, "JHU": JHU}[palette_name]
-    for color_name, color in track(
-        palette.items(),
+    palette_name = palette.upper()
+    outputs = palette_sprite_paths(input_path.stem, output_dir, palette_name)
+    asset_store = AssetStore(store) if store is not None else None
+    manifest = {}
+    for color, output_path in track(
+        outputs,
         description=f"Creating {palette_name} sprites...",
-        total=len(palette),
+        total=len(outputs),
     ):
-        if color_name.startswith("_"):
-            continue
-        if palette_name == "JHU":
-            color_name = filenamecase(color_name)
-        output_path = output_dir / f"{input_path.stem}_{color_name}.png"
-        make_sprite(input_path, output_path, background, color, fuzz=fuzz, crop=crop)
+        options = dict(
+            background=background,
+            foreground=color,
+            fuzz=fuzz,
+            crop=crop,
+            metric=metric,
+            threads=threads,
+        )
+        if asset_store is None:
+            make_sprite(input_path, output_path, **options)
+        else:
+            manifest[output_path.name] = asset_store.make_sprite(
+                input_path, output_path, **options
+            )
+
+    if asset_store is not None:
+        write_manifest(output_dir, manifest)
+        log.info(
+            f"Reused {asset_store.hits} and made {asset_store.misses} sprites in {store}."
+        )
+
+
+@cli.command(
+    help="Start a long-running process that handles sprite and palette requests on a Unix socket."
+)
+@click.option(
+    "--socket",
+    type=click.Path(),
+    default=None,
+    help="Path of the socket to listen on. Defaults to $TULL_SOCKET or a per-user path.",
+)
+@click.option(
+    "--workers",
+    "-j",
+    type=int,
+    default=None,
+    help="Number of requests to handle concurrently. Defaults to the number of CPUs.",
+)
+def serve(socket, workers):
+    from .server import serve as run_server
+
+    run_server(socket, workers)
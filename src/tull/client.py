@@ -0,0 +1,91 @@
+"""Client side of the `tull serve` protocol.
+
+This module only imports the standard library, so that sending a request to a
+running server does not pay for importing NumPy and friends.
+"""
+
+from __future__ import annotations
+import json
+import os
+import socket
+import struct
+import tempfile
+from pathlib import Path
+from typing import Any, BinaryIO
+
+_HEADER = struct.Struct(">I")
+
+
+def default_socket_path() -> Path:
+    """Get the socket path from $TULL_SOCKET, or a per-user default."""
+    if (path := os.environ.get("TULL_SOCKET")) is not None:
+        return Path(path)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir())
+    return Path(runtime_dir) / f"tull-{os.getuid()}.sock"
+
+
+def check_owner(socket_path: Path):
+    """Raise PermissionError if the socket belongs to another user.
+
+    Sockets in a shared directory like /tmp could have been created by anyone, who
+    would then see the requests, or could stand in for a server that is not running.
+    """
+    owner = os.lstat(socket_path).st_uid
+    if owner != os.getuid():
+        raise PermissionError(
+            f"{socket_path} is owned by uid {owner}, not the current user."
+        )
+
+
+def send_message(stream: BinaryIO, message: dict[str, Any]):
+    data = json.dumps(message).encode("utf-8")
+    stream.write(_HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def recv_message(stream: BinaryIO) -> dict[str, Any]:
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ConnectionError("Connection closed before a message was received.")
+    (size,) = _HEADER.unpack(header)
+    data = stream.read(size)
+    if len(data) < size:
+        raise ConnectionError("Connection closed in the middle of a message.")
+    return json.loads(data.decode("utf-8"))
+
+
+def send_request(
+    request: dict[str, Any], socket_path: Path | None = None
+) -> dict[str, Any]:
+    """Send a request to a running server and return its response.
+
+    Raises:
+        ConnectionError: If no server is listening on the socket.
+        PermissionError: If the socket belongs to another user.
+        RuntimeError: If the server failed to handle the request.
+    """
+    socket_path = default_socket_path() if socket_path is None else Path(socket_path)
+    try:
+        check_owner(socket_path)
+    except FileNotFoundError as e:
+        raise ConnectionError(f"No server running at {socket_path}.") from e
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise ConnectionError(f"No server running at {socket_path}.") from e
+        with sock.makefile("rwb") as stream:
+            send_message(stream, request)
+            response = recv_message(stream)
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error"))
+    return response
+
+
+def is_running(socket_path: Path | None = None) -> bool:
+    """Check whether a server is accepting requests on the socket."""
+    try:
+        send_request({"command": "ping"}, socket_path)
+    except ConnectionError:
+        return False
+    return True
@@ -0,0 +1,208 @@
+"""A long-running worker that serves sprite and palette requests over a Unix socket.
+
+Starting Python and importing NumPy, OpenCV, etc. dominates the runtime of small
+requests. The server pays that cost once and keeps the palettes and cached colors
+warm, handling each connection on a thread pool.
+
+Messages in both directions are a 4-byte big-endian length followed by a JSON object.
+Requests look like:
+
+    {"command": "sprite", "input": "/abs/path.png", "output": "/abs/out.png", ...}
+    {"command": "sprite", "data": "<base64 image>", "background": "black"}
+    {"command": "palette", "input": "/abs/path.png", "output": "/abs/dir", "palette": "TUM"}
+    {"command": "palette", ..., "store": "/abs/store"}
+    {"command": "ping"}
+
+Raw image bytes are passed base64-encoded in "data". If a sprite request has no
+"output", the resulting PNG is returned base64-encoded in the response's "data".
+Responses have "ok" and either the results or an "error" message.
+"""
+
+from __future__ import annotations
+import base64
+import logging
+import os
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from .client import (
+    check_owner,
+    default_socket_path,
+    is_running,
+    recv_message,
+    send_message,
+)
+
+log = logging.getLogger(__name__)
+
+# Keyword arguments of make_sprite that requests may set.
+SPRITE_OPTIONS = (
+    "background",
+    "foreground",
+    "edge",
+    "edge_thickness",
+    "fuzz",
+    "crop",
+    "max_alpha",
+    "metric",
+    "threads",
+)
+
+
+def _read_input(request: dict[str, Any]) -> Path | bytes:
+    if "data" in request:
+        return base64.b64decode(request["data"])
+    if "input" in request:
+        return Path(request["input"])
+    raise ValueError('Request must have an "input" path or image "data".')
+
+
+def _open(source: Path | bytes) -> Path | BinaryIO:
+    return BytesIO(source) if isinstance(source, bytes) else source
+
+
+def handle_request(request: dict[str, Any]) -> dict[str, Any]:
+    """Run a single request, returning the results to send back."""
+    from .utils import make_sprite, palette_sprite_paths
+    from .utils.store import AssetStore, write_manifest
+
+    if not isinstance(request, dict):
+        raise ValueError(
+            f"Request must be a JSON object, not {type(request).__name__}."
+        )
+    command = request.get("command")
+    log.info(f"Handling {command} request.")
+    options = {k: request[k] for k in SPRITE_OPTIONS if k in request}
+    options.setdefault("background", "white")
+
+    if command == "ping":
+        return {"pid": os.getpid()}
+
+    elif command == "sprite":
+        source = _read_input(request)
+        options.setdefault("foreground", None)
+        if request.get("output") is None:
+            buffer = BytesIO()
+            make_sprite(_open(source), buffer, **options)
+            return {"data": base64.b64encode(buffer.getvalue()).decode("ascii")}
+        output_path = Path(request["output"])
+        make_sprite(_open(source), output_path, **options)
+        return {"output": str(output_path)}
+
+    elif command == "palette":
+        source = _read_input(request)
+        if request.get("output") is None:
+            raise ValueError("Palette requests must have an output directory.")
+        stem = request.get("stem", Path(request.get("input", "image")).stem)
+        output_dir = Path(request["output"])
+        output_dir.mkdir(exist_ok=True, parents=True)
+        options.pop("foreground", None)
+        outputs = palette_sprite_paths(stem, output_dir, request.get("palette", "TUM"))
+        if request.get("store") is None:
+            for color, output_path in outputs:
+                make_sprite(_open(source), output_path, foreground=color, **options)
+            return {"outputs": [str(path) for _, path in outputs]}
+
+        store = AssetStore(request["store"])
+        manifest = {}
+        for color, output_path in outputs:
+            manifest[output_path.name] = store.make_sprite(
+                source, output_path, foreground=color, **options
+            )
+        write_manifest(output_dir, manifest)
+        return {
+            "outputs": [str(path) for _, path in outputs],
+            "digests": manifest,
+        }
+
+    else:
+        raise ValueError(f"Unknown command: {command}")
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = recv_message(self.rfile)
+        except ConnectionError as e:
+            log.warning(f"Bad request: {e}")
+            return
+        except ValueError as e:
+            # Malformed JSON or UTF-8. Reply, so the client can tell this from a crash.
+            log.warning(f"Bad request: {e}")
+            send_message(self.wfile, {"ok": False, "error": f"Bad request: {e}"})
+            return
+
+        try:
+            response = {"ok": True, **handle_request(request)}
+        except Exception as e:
+            log.exception("Failed to handle request.")
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        send_message(self.wfile, response)
+
+
+class SpriteServer(socketserver.UnixStreamServer):
+    """A Unix socket server that handles each connection on a pool of worker threads.
+
+    Most of the work is in NumPy, which releases the GIL, so threads run concurrently.
+
+    Args:
+        socket_path (Path): Path to bind the socket to. A stale socket is replaced.
+            The socket is only accessible by the current user, since the server reads
+            and writes any path it is given.
+        workers (int | None): Number of worker threads. Defaults to the CPU count.
+
+    """
+
+    def __init__(self, socket_path: Path, workers: int | None = None):
+        self.socket_path = Path(socket_path)
+        if self.socket_path.exists() or self.socket_path.is_symlink():
+            check_owner(self.socket_path)
+            if is_running(self.socket_path):
+                raise RuntimeError(f"A server is already running at {socket_path}.")
+            self.socket_path.unlink()
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        super().__init__(str(self.socket_path), RequestHandler)
+
+    def server_bind(self):
+        # Create the socket without group or other permissions, rather than
+        # tightening them after a window where other users could connect.
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=True)
+        self.socket_path.unlink(missing_ok=True)
+
+
+def serve(socket_path: Path | None = None, workers: int | None = None):
+    """Serve requests until interrupted."""
+    socket_path = default_socket_path() if socket_path is None else Path(socket_path)
+    # Import the heavy modules up front, so the first request does not pay for them.
+    from . import utils  # noqa: F401
+    from .utils import store  # noqa: F401
+
+    with SpriteServer(socket_path, workers) as server:
+        log.warning(f"Serving on {socket_path}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            log.info("Shutting down.")
@@ -1,4 +1,4 @@
 from .colors import get_color
-from .sprite import make_sprite
+from .sprite import make_sprite, palette_sprite_paths
 
 from .cases import filenamecase, classcase
@@ -2,6 +2,7 @@ import matplotlib.colors as mcolors
 import numpy as np
 import re
 from enum import Enum, auto
+from functools import lru_cache
 from pathlib import Path
 
 from ..palettes import JHU, TUM
@@ -52,3 +53,170 @@ def get_color(user_input: str | tuple[int, int, int] | int) -> np.ndarray:
         raise ValueError(f"Invalid color input: {user_input}")
 
     return color
+
+
+# sRGB (D65) to CIE XYZ, and the D65 reference white.
+_RGB_TO_XYZ = np.array(
+    [
+        [0.4124564, 0.3575761, 0.1804375],
+        [0.2126729, 0.7151522, 0.0721750],
+        [0.0193339, 0.1191920, 0.9503041],
+    ],
+    dtype=np.float32,
+)
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+
+# Fold the white point normalization into the matrix so each pixel is one matmul.
+_RGB_TO_XYZN = (_RGB_TO_XYZ / _D65_WHITE[:, None]).T.astype(np.float32)
+
+# Number of pixels converted at a time, so temporaries stay small.
+CHUNK_SIZE = 1 << 16
+
+METRICS = ("rgb", "lab", "deltaE2000")
+
+
+def _rgb_to_lab_chunk(rgb: np.ndarray) -> np.ndarray:
+    """Convert an (N, 3) float32 sRGB array in [0, 1] to CIE Lab."""
+    linear = np.where(
+        rgb <= 0.04045, rgb / 12.92, np.power((rgb + 0.055) / 1.055, 2.4)
+    ).astype(np.float32, copy=False)
+    xyz = linear @ _RGB_TO_XYZN
+    delta = 6 / 29
+    f = np.where(
+        xyz > delta**3, np.cbrt(xyz), xyz / (3 * delta**2) + 4 / 29
+    ).astype(np.float32, copy=False)
+    lab = np.empty_like(f)
+    lab[:, 0] = 116 * f[:, 1] - 16
+    lab[:, 1] = 500 * (f[:, 0] - f[:, 1])
+    lab[:, 2] = 200 * (f[:, 1] - f[:, 2])
+    return lab
+
+
+def rgb_to_lab(rgb: np.ndarray, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """Convert an sRGB array (..., 3) in range [0,1] to CIE Lab (D65).
+
+    The conversion is done `chunk_size` pixels at a time to bound the size of the
+    intermediate arrays.
+    """
+    rgb = np.asarray(rgb, dtype=np.float32)
+    flat = rgb.reshape(-1, 3)
+    lab = np.empty_like(flat)
+    for start in range(0, flat.shape[0], chunk_size):
+        lab[start : start + chunk_size] = _rgb_to_lab_chunk(
+            flat[start : start + chunk_size]
+        )
+    return lab.reshape(rgb.shape)
+
+
+@lru_cache(maxsize=64)
+def _cached_lab(rgb: tuple[float, float, float]) -> np.ndarray:
+    lab = _rgb_to_lab_chunk(np.array([rgb], dtype=np.float32))[0]
+    lab.flags.writeable = False
+    return lab
+
+
+def color_to_lab(color: np.ndarray) -> np.ndarray:
+    """Convert a single RGB color (3,) in range [0,1] to Lab, caching the result."""
+    return _cached_lab(tuple(float(c) for c in np.asarray(color).reshape(3)))
+
+
+def delta_e_2000(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """CIEDE2000 color difference between Lab arrays (..., 3), with kL = kC = kH = 1."""
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    C1 = np.hypot(a1, b1)
+    C2 = np.hypot(a2, b2)
+    C_bar7 = ((C1 + C2) / 2) ** 7
+    G = 0.5 * (1 - np.sqrt(C_bar7 / (C_bar7 + 25.0**7)))
+    a1p = (1 + G) * a1
+    a2p = (1 + G) * a2
+    C1p = np.hypot(a1p, b1)
+    C2p = np.hypot(a2p, b2)
+    h1p = np.degrees(np.arctan2(b1, a1p)) % 360
+    h2p = np.degrees(np.arctan2(b2, a2p)) % 360
+
+    dLp = L2 - L1
+    dCp = C2p - C1p
+    chroma_zero = (C1p * C2p) == 0
+    dhp = h2p - h1p
+    dhp = np.where(dhp > 180, dhp - 360, dhp)
+    dhp = np.where(dhp < -180, dhp + 360, dhp)
+    dhp = np.where(chroma_zero, 0, dhp)
+    dHp = 2 * np.sqrt(C1p * C2p) * np.sin(np.radians(dhp) / 2)
+
+    Lp_bar = (L1 + L2) / 2
+    Cp_bar = (C1p + C2p) / 2
+    hp_sum = h1p + h2p
+    hp_bar = (
+        np.where(
+            np.abs(h1p - h2p) > 180,
+            np.where(hp_sum < 360, hp_sum + 360, hp_sum - 360),
+            hp_sum,
+        )
+        / 2
+    )
+    hp_bar = np.where(chroma_zero, hp_sum, hp_bar)
+
+    T = (
+        1
+        - 0.17 * np.cos(np.radians(hp_bar - 30))
+        + 0.24 * np.cos(np.radians(2 * hp_bar))
+        + 0.32 * np.cos(np.radians(3 * hp_bar + 6))
+        - 0.20 * np.cos(np.radians(4 * hp_bar - 63))
+    )
+    d_theta = 30 * np.exp(-(((hp_bar - 275) / 25) ** 2))
+    Cp_bar7 = Cp_bar**7
+    R_C = 2 * np.sqrt(Cp_bar7 / (Cp_bar7 + 25.0**7))
+    S_L = 1 + 0.015 * (Lp_bar - 50) ** 2 / np.sqrt(20 + (Lp_bar - 50) ** 2)
+    S_C = 1 + 0.045 * Cp_bar
+    S_H = 1 + 0.015 * Cp_bar * T
+    R_T = -np.sin(np.radians(2 * d_theta)) * R_C
+
+    dL = dLp / S_L
+    dC = dCp / S_C
+    dH = dHp / S_H
+    return np.sqrt(dL**2 + dC**2 + dH**2 + R_T * dC * dH)
+
+
+def color_distance(
+    rgb: np.ndarray,
+    color: np.ndarray,
+    metric: str = "rgb",
+    chunk_size: int = CHUNK_SIZE,
+) -> np.ndarray:
+    """Per-pixel distance between an RGB image (H, W, 3) and a single color.
+
+    Args:
+        rgb (np.ndarray): Image with values in [0, 1].
+        color (np.ndarray): RGB color (3,) in range [0,1].
+        metric (str): "rgb" for the mean absolute RGB difference (in [0, 1]), "lab"
+            for the Euclidean distance in CIE Lab (CIE76), or "deltaE2000" for CIEDE2000.
+        chunk_size (int): Number of pixels to process at a time for the Lab metrics.
+
+    Returns:
+        np.ndarray: The (H, W) distance, float64 for "rgb" and float32 otherwise.
+    """
+    if metric == "rgb":
+        # Average in float64, as the rgb metric always has, so its output is unchanged.
+        # Going one channel at a time keeps the temporaries two-dimensional.
+        color = np.asarray(color, dtype=np.float64)
+        distance = np.abs(np.subtract(rgb[..., 0], color[0], dtype=np.float64))
+        for c in (1, 2):
+            distance += np.abs(np.subtract(rgb[..., c], color[c], dtype=np.float64))
+        distance /= 3
+        return distance
+    if metric not in METRICS:
+        raise ValueError(f"Invalid metric: {metric}. Must be one of {METRICS}.")
+
+    color_lab = color_to_lab(color)
+    flat = np.asarray(rgb, dtype=np.float32).reshape(-1, 3)
+    distance = np.empty(flat.shape[0], dtype=np.float32)
+    for start in range(0, flat.shape[0], chunk_size):
+        lab = _rgb_to_lab_chunk(flat[start : start + chunk_size])
+        if metric == "lab":
+            d = np.linalg.norm(lab - color_lab, axis=1)
+        else:
+            d = delta_e_2000(lab, color_lab)
+        distance[start : start + chunk_size] = d
+    return distance.reshape(rgb.shape[:2])
@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Target size of the strips each thread works on, roughly a per-core L2 cache.
+STRIP_BYTES = 256 * 1024
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Get the pool shared by all calls, with one thread per CPU."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=resolve_threads(None), thread_name_prefix="tull-rows"
+            )
+        return _executor
+
+
+def resolve_threads(threads: int | None) -> int:
+    """Get the number of threads to use, where None or 0 means all CPUs."""
+    if not threads:
+        return os.cpu_count() or 1
+    return max(1, threads)
+
+
+def map_rows(
+    func: Callable[..., None],
+    *arrays: np.ndarray,
+    threads: int | None = 1,
+    strip_bytes: int = STRIP_BYTES,
+    scratch_bytes: int = 0,
+):
+    """Apply an elementwise function to horizontal strips of arrays, in parallel.
+
+    `func` is called as `func(*strips)`, where each strip is a view of rows
+    `start:stop` of the corresponding array, and should write its results into one of
+    the (output) strips. Strips are sized so that the rows of all the arrays, plus
+    the temporaries `func` makes for them, fit in about `strip_bytes`, keeping the
+    working set in cache across every step of `func`. Each thread processes a contiguous block of strips. NumPy releases the GIL
+    inside ufuncs, so the blocks are processed concurrently.
+
+    Args:
+        func (Callable[..., None]): Function applied to each set of strips.
+        arrays (np.ndarray): Arrays with the same number of rows (first dimension).
+        threads (int | None): Number of threads. None or 0 uses all CPUs, and more
+            threads than CPUs are not used.
+        strip_bytes (int): Approximate number of bytes in each set of strips.
+        scratch_bytes (int): Bytes of temporaries `func` allocates per row.
+
+    """
+    num_rows = arrays[0].shape[0]
+    assert all(a.shape[0] == num_rows for a in arrays)
+    row_bytes = scratch_bytes + sum(a.nbytes // max(a.shape[0], 1) for a in arrays)
+    rows_per_strip = max(1, strip_bytes // max(row_bytes, 1))
+    starts = range(0, num_rows, rows_per_strip)
+
+    def run(block: range):
+        for start in block:
+            stop = start + rows_per_strip
+            func(*(a[start:stop] for a in arrays))
+
+    threads = min(resolve_threads(threads), resolve_threads(None), len(starts))
+    if threads <= 1:
+        run(starts)
+        return
+
+    # Split the strips into one contiguous block per thread, running the first here.
+    bounds = [len(starts) * i // threads for i in range(threads + 1)]
+    blocks = [starts[bounds[i] : bounds[i + 1]] for i in range(threads)]
+    executor = _get_executor()
+    futures = [executor.submit(run, block) for block in blocks[1:]]
+    run(blocks[0])
+    for future in futures:
+        future.result()
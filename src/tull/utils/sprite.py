@@ -1,17 +1,74 @@
 from pathlib import Path
+from typing import BinaryIO
 import logging
+import os
+import uuid
 import numpy as np
 from PIL import Image
 import skfmm
 
-from .colors import get_color
+from ..palettes import JHU, TUM, Palette
+from .cases import filenamecase
+from .colors import get_color, color_distance
+from .parallel import map_rows
 
 log = logging.getLogger(__name__)
 
+# Range of the background distance mapped to alpha in [0, 1], for each metric.
+# The Lab metrics are in units of delta E, where ~2.3 is a just noticeable difference.
+ALPHA_RANGES = {
+    "rgb": (0.05, 0.8),
+    "lab": (2.5, 60.0),
+    "deltaE2000": (2.5, 40.0),
+}
+
+# Approximate bytes of temporaries per pixel in make_sprite's per-strip pipeline for
+# each metric, including the float copy of the strip (measured with tracemalloc), so
+# map_rows can size strips by what they really touch.
+SCRATCH_BYTES = {
+    "rgb": 80,
+    "lab": 160,
+    "deltaE2000": 312,
+}
+
+
+def get_palette(name: str) -> Palette:
+    """Get a built-in palette by (case-insensitive) name."""
+    palette_name = name.upper()
+    if palette_name not in ["TUM", "JHU"]:
+        raise ValueError(
+            f"Unsupported palette: {name}. Supported palettes are TUM and JHU."
+        )
+    return {"TUM": TUM, "JHU": JHU}[palette_name]
+
+
+def palette_sprite_paths(
+    stem: str, output_dir: Path, palette_name: str
+) -> list[tuple[np.ndarray, Path]]:
+    """Get the foreground color and output path of each sprite in a palette.
+
+    Args:
+        stem (str): Stem of the input image, used to name the outputs.
+        output_dir (Path): Directory the sprites are written to.
+        palette_name (str): Name of the palette, "TUM" or "JHU".
+
+    Returns:
+        list[tuple[np.ndarray, Path]]: The (color, output_path) pairs, skipping private colors.
+    """
+    palette = get_palette(palette_name)
+    outputs = []
+    for color_name, color in palette.items():
+        if color_name.startswith("_"):
+            continue
+        if palette_name.upper() == "JHU":
+            color_name = filenamecase(color_name)
+        outputs.append((color, Path(output_dir) / f"{stem}_{color_name}.png"))
+    return outputs
+
 
 def make_sprite(
-    input_path: Path,
-    output_path: Path,
+    input_path: Path | BinaryIO,
+    output_path: Path | BinaryIO,
     background: str,
     foreground: str | None,
     edge: str | None = None,
@@ -19,53 +76,108 @@ def make_sprite(
     fuzz: bool = True,
     crop: bool = True,
     max_alpha: float | int = 1.0,
+    metric: str = "rgb",
+    threads: int | None = 1,
 ):
     log.info(f"Processing {input_path} into {output_path}.")
+    if metric not in ALPHA_RANGES:
+        raise ValueError(
+            f"Invalid metric: {metric}. Must be one of {tuple(ALPHA_RANGES)}."
+        )
 
-    image = np.array(Image.open(input_path).convert("RGBA"))
-    # Convert to float in range [0, 1]
-    image = image.astype(np.float32) / 255
-
-    alpha = image[:, :, 3]
-    intensity: np.ndarray = image[:, :, :3].mean(axis=2)
+    pixels = np.asarray(Image.open(input_path).convert("RGBA"))
+    has_transparency = not np.all(pixels[:, :, 3] == 255)
 
     bg_color = get_color(background)
-    bg_intensity: float = bg_color.mean()
+    alpha_min, alpha_max = ALPHA_RANGES[metric]
+    # Match the image's dtype, so assigning the color does not promote anything.
+    fg_color = None if foreground is None else get_color(foreground).astype(np.float32)
+    if isinstance(max_alpha, int):
+        max_alpha = max_alpha / 255
 
     # Set the alpha channel to the difference between the pixel intensity and the background intensity
-    if not np.all(alpha == 1):
+    if has_transparency:
         log.info("Image already has transparency. Skipping.")
     elif fuzz:
         log.debug("Setting alpha channel with fuzz.")
-        alpha: np.ndarray = np.abs(image[:, :, :3] - bg_color).mean(axis=2)
-        # plt.imshow(alpha)
-        # plt.show()
-        # log.info(f"alpha: {alpha.shape}, {alpha.min()}, {alpha.max()}")
-        # Scale alpha to the range [0, 1]
-        alpha_min = 0.05
-        alpha_max = 0.8
-        alpha = np.clip(alpha, alpha_min, alpha_max)
-        alpha = (alpha - alpha_min) / (alpha_max - alpha_min)
     else:
         log.debug("Setting alpha channel without fuzz.")
-        alpha = (np.abs(intensity - bg_intensity) < 0.05).astype(np.float32)
 
-    # Set the foreground color
-    log.debug("Setting foreground color.")
-    if foreground is not None:
+    if fg_color is not None:
         log.debug(f"Foreground color: {foreground}")
-        fg_color = get_color(foreground)
-        fg_image = np.full_like(image[:, :, :3], fg_color)
-        output_image = np.dstack([fg_image, alpha])
-
     else:
         log.debug(
             "No foreground color specified. Keeping original image with new alpha."
         )
-        output_image = image
-        output_image[:, :, 3] = alpha
 
-    if edge is not None:
+    # The elementwise steps below run together on each strip of rows (see map_rows),
+    # so a strip stays in cache from the uint8 input to the uint8 output.
+    def set_alpha(image, a):
+        if has_transparency:
+            a[:] = image[:, :, 3]
+        elif fuzz:
+            # Scale alpha to the range [0, 1], in the precision of the distance
+            distance = color_distance(image[:, :, :3], bg_color, metric)
+            np.clip(distance, alpha_min, alpha_max, out=distance)
+            distance -= alpha_min
+            distance /= alpha_max - alpha_min
+            a[:] = distance
+        else:
+            a[:] = color_distance(image[:, :, :3], bg_color, metric) >= alpha_min
+
+    def recolor(image, a):
+        if fg_color is not None:
+            image[:, :, :3] = fg_color
+        image[:, :, 3] = a
+
+    def to_uint8(image, a, dst):
+        # Scale the alpha channel to the range [0, max_alpha]
+        np.multiply(a, max_alpha, out=image[:, :, 3])
+        np.multiply(image, 255, out=dst, casting="unsafe")
+
+    # Strips are runs of pixels rather than image rows (the arrays are viewed with
+    # shape (H * W, 1, ...)), so that they fit in cache even for very wide images.
+    def flat(array: np.ndarray) -> np.ndarray:
+        return array.reshape(-1, 1, *array.shape[2:])
+
+    scratch_bytes = 16 if has_transparency else SCRATCH_BYTES[metric]
+    alpha = np.empty(pixels.shape[:2], dtype=np.float32)
+    if edge is None:
+        result = np.empty(pixels.shape, dtype=np.uint8)
+
+        def process(src, a, dst):
+            # Convert to float in range [0, 1]
+            image = np.divide(src, np.float32(255), dtype=np.float32)
+            set_alpha(image, a)
+            recolor(image, a)
+            to_uint8(image, a, dst)
+
+        map_rows(
+            process,
+            flat(pixels),
+            flat(alpha),
+            flat(result),
+            threads=threads,
+            scratch_bytes=scratch_bytes,
+        )
+
+    else:
+        output_image = np.empty(pixels.shape, dtype=np.float32)
+
+        def process(src, a, image):
+            np.divide(src, np.float32(255), out=image, dtype=np.float32)
+            set_alpha(image, a)
+            recolor(image, a)
+
+        map_rows(
+            process,
+            flat(pixels),
+            flat(alpha),
+            flat(output_image),
+            threads=threads,
+            scratch_bytes=scratch_bytes,
+        )
+
         # Make a signed distance transform of the alpha channel
         pad = edge_thickness + 1
         alpha = np.pad(alpha, pad, mode="constant", constant_values=0)
@@ -87,10 +199,10 @@ def make_sprite(
         output_image = np.where(edge_map[:, :, None], edge_image, output_image)
         alpha = np.maximum(alpha, edge_alpha)
 
-    # Scale the alpha channel to the range [0, max_alpha]
-    if isinstance(max_alpha, int):
-        max_alpha = max_alpha / 255
-    output_image[:, :, 3] = alpha * max_alpha
+        result = np.empty(output_image.shape, dtype=np.uint8)
+        map_rows(
+            to_uint8, flat(output_image), flat(alpha), flat(result), threads=threads
+        )
 
     # Crop the image to the bounding box of the non-background pixels
     if crop:
@@ -101,8 +213,34 @@ def make_sprite(
         rmin, rmax = np.where(rows)[0][[0, -1]]
         cmin, cmax = np.where(cols)[0][[0, -1]]
         log.info(f"Cropping to rows {rmin}:{rmax} and cols {cmin}:{cmax}.")
-        output_image = output_image[rmin:rmax, cmin:cmax]
+        result = result[rmin:rmax, cmin:cmax]
 
     # Save the image
     log.debug("Saving image.")
-    Image.fromarray((output_image * 255).astype(np.uint8)).save(output_path)
+    image = Image.fromarray(np.ascontiguousarray(result))
+    if isinstance(output_path, (str, Path)):
+        save_atomic(image, Path(output_path))
+    else:
+        # File objects (e.g. for the server) have no suffix to infer the format from.
+        image.save(output_path, format="PNG")
+
+
+def save_atomic(image: Image.Image, output_path: Path):
+    """Save an image to a temporary file, then rename it onto output_path.
+
+    The rename replaces an existing file rather than writing into it, so outputs that
+    are hardlinks into an AssetStore are never modified through the link.
+    """
+    suffix = output_path.suffix.lower()
+    format = Image.registered_extensions().get(suffix)
+    if format is None:
+        raise ValueError(f"Unknown file extension: {output_path.suffix}")
+    tmp = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        # Opened normally (not with mkstemp), so the file gets the usual permissions.
+        with open(tmp, "xb") as f:
+            image.save(f, format=format)
+        os.replace(tmp, output_path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
@@ -0,0 +1,214 @@
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+import PIL
+
+from .colors import get_color
+from .sprite import make_sprite
+
+log = logging.getLogger(__name__)
+
+
+def _code_version() -> str:
+    """Hash the code behind make_sprite's output, and the NumPy and Pillow versions."""
+    h = hashlib.sha256(f"{PIL.__version__} {np.__version__}".encode())
+    for name in ("sprite.py", "colors.py", "parallel.py"):
+        h.update((Path(__file__).parent / name).read_bytes())
+    return h.hexdigest()[:16]
+
+
+# Part of every work key, so results from other versions of the code are not reused.
+STORE_VERSION = _code_version()
+
+# Permissions of stored files, readable by everyone sharing the store.
+OBJECT_MODE = 0o444
+WORK_MODE = 0o644
+
+# make_sprite options that do not affect its output, and are left out of work keys.
+_IGNORED_OPTIONS = ("threads",)
+
+# make_sprite options that are colors, hashed by their RGB value rather than spelling.
+_COLOR_OPTIONS = ("background", "foreground", "edge")
+
+MANIFEST_NAME = "manifest.json"
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return [round(float(x), 6) for x in value.ravel()]
+    if isinstance(value, Path):
+        return str(value)
+    return value
+
+
+class AssetStore:
+    def __init__(self, root: str | Path):
+        """A content-addressed store of rendered sprites.
+
+        Each output is stored once, under the sha256 of its bytes, in `root/objects`.
+        Outputs are exposed at their usual paths through hardlinks (or copies, where
+        the filesystem does not support hardlinks). The options used to make each
+        output are hashed into a work key, recorded in `root/work`, so that repeated
+        work is found by its key and skipped without rendering or encoding.
+
+        Args:
+            root (str | Path): Directory of the store. Created if it does not exist.
+
+        """
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.work_dir = self.root / "work"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self._file_digests: dict[tuple[str, int, int], str] = {}
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects_dir / digest[:2] / f"{digest[2:]}.png"
+
+    def _write_atomic(self, path: Path, data: bytes, mode: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            # mkstemp creates files readable only by their owner.
+            os.chmod(tmp, mode)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def input_digest(self, source: Path | bytes) -> str:
+        """Get the sha256 of an input image, caching it for unchanged files."""
+        if isinstance(source, bytes):
+            return hashlib.sha256(source).hexdigest()
+        stat = Path(source).stat()
+        cache_key = (str(Path(source).absolute()), stat.st_mtime_ns, stat.st_size)
+        if (digest := self._file_digests.get(cache_key)) is None:
+            digest = hashlib.sha256(Path(source).read_bytes()).hexdigest()
+            self._file_digests[cache_key] = digest
+        return digest
+
+    def work_key(self, input_digest: str, **options) -> str:
+        """Hash an input and the options used to process it."""
+        options = {
+            k: _jsonable(get_color(v) if k in _COLOR_OPTIONS and v is not None else v)
+            for k, v in options.items()
+            if k not in _IGNORED_OPTIONS
+        }
+        key = json.dumps(
+            dict(version=STORE_VERSION, input=input_digest, options=options),
+            sort_keys=True,
+        )
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def lookup(self, key: str) -> str | None:
+        """Get the digest of the output of some work, if it is in the store."""
+        path = self.work_dir / key[:2] / key[2:]
+        try:
+            digest = path.read_text().strip()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            log.debug(f"Treating unreadable work entry {path} as a miss: {e}")
+            return None
+        if not self._verify(digest):
+            return None
+        return digest
+
+    def _verify(self, digest: str, warn: bool = True) -> bool:
+        """Check that an object exists and still has the digest it is stored under."""
+        try:
+            data = self.object_path(digest).read_bytes()
+        except FileNotFoundError:
+            return False
+        if hashlib.sha256(data).hexdigest() != digest:
+            if warn:
+                log.warning(f"Stored object {digest[:12]} was modified.")
+            return False
+        return True
+
+    def put(self, data: bytes, key: str | None = None) -> str:
+        """Add an output to the store, returning its digest.
+
+        Args:
+            data (bytes): The encoded output.
+            key (str | None): Work key that produced the output, to record.
+
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not self._verify(digest, warn=False):
+            # Objects are shared by every link to them, so protect them from edits.
+            self._write_atomic(path, data, OBJECT_MODE)
+        if key is not None:
+            self._write_atomic(
+                self.work_dir / key[:2] / key[2:], digest.encode(), WORK_MODE
+            )
+        return digest
+
+    def link(self, digest: str, output_path: Path):
+        """Expose a stored output at output_path.
+
+        The link is made under a temporary name and renamed onto output_path, which
+        replaces any existing file there rather than writing through it. (If that file
+        were itself a link to an object, writing to it would change the object.)
+        """
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            try:
+                os.link(self.object_path(digest), tmp)
+            except OSError:
+                shutil.copyfile(self.object_path(digest), tmp)
+            os.replace(tmp, output_path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def make_sprite(self, source: Path | bytes, output_path: Path, **options) -> str:
+        """Like make_sprite, but reuse stored results and store new ones.
+
+        Args:
+            source (Path | bytes): Input image path or encoded image.
+            output_path (Path): Where to expose the resulting PNG.
+            options: Keyword arguments to make_sprite.
+
+        Returns:
+            str: The digest of the output.
+        """
+        key = self.work_key(self.input_digest(source), **options)
+        digest = self.lookup(key)
+        if digest is not None:
+            log.debug(f"Reusing {digest[:12]} for {output_path}.")
+            self.hits += 1
+        else:
+            self.misses += 1
+            buffer = BytesIO()
+            make_sprite(
+                BytesIO(source) if isinstance(source, bytes) else source,
+                buffer,
+                **options,
+            )
+            digest = self.put(buffer.getvalue(), key)
+        self.link(digest, output_path)
+        return digest
+
+
+def write_manifest(output_dir: Path, outputs: dict[str, str]):
+    """Write a manifest mapping output file names to their digests in the store."""
+    path = Path(output_dir) / MANIFEST_NAME
+    path.write_text(json.dumps(outputs, indent=2, sort_keys=True) + "\n")